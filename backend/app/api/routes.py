@@ -1,21 +1,29 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Form, Query
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Form, Query, Request
 from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
 import os
 import uuid
 import json
 import mimetypes
 from typing import Optional
 from app.core.config import settings
-from app.services.transcription import process_media_file
-from app.services.translation import process_vtt_file
+from app.services.transcription import process_media_file, probe_media_duration, normalize_language, get_preset_metrics, TRANSCRIPTION_PRESETS, DEFAULT_PRESET
+from app.services.translation import process_vtt_file, LANGUAGE_CODE_TO_NAME
+from app.services.pipeline import process_media_file_with_translation
 from app.services.file_cleanup import clear_uploads_directory
+from app.services.cancellation import ProcessingCancelled, run_until_disconnected
+from app.services.scheduler import AdmissionRejected, transcription_scheduler
 
 router = APIRouter()    # Create new router instance to be imported in main.py
 
 @router.post("/transcribe/")    # Receive post requests to /api/v1/transcribe
 async def transcribe_audio( 
-    file: UploadFile = File(...),      # File to be transcribed (required)
-    use_api: bool = Form(False),       # Determine if using OpenAI API for transcription (default: False)
+    request: Request,
+    file: UploadFile = File(...),           # File to be transcribed (required)
+    use_api: bool = Form(False),            # Determine if using OpenAI API for transcription (default: False)
+    use_vad: bool = Form(False),            # Skip silence/non-speech before transcribing (default: False)
+    preset: str = Form(DEFAULT_PRESET),     # Speed/accuracy preset for the local model (default: "balanced")
+    language: Optional[str] = Form(None),   # Source-language hint, skips language detection (optional)
 ):
     """
     Endpoint to transcribe an audio file and generate subtitles.
@@ -23,7 +31,9 @@ async def transcribe_audio(
     Args:
         file: The audio file to transcribe
         use_api: Whether to use OpenAI API (True) or local model (False) for Whisper transcription
-        model_size: Size of Whisper model to use (if using local model)
+        use_vad: Whether to run a voice activity detection pre-pass so only speech is sent to Whisper
+        preset: Speed/accuracy preset ("fast", "balanced", "accurate") that sets the Whisper model size and decoding options
+        language: Language of the audio (ex. "en"); if omitted or "detect", Whisper detects it
     
     Returns:
         JSON with transcription info and VTT file path
@@ -32,6 +42,14 @@ async def transcribe_audio(
     # Validate file type
     if file.content_type not in ["audio/mpeg", "audio/wav", "video/mp4", "video/quicktime"]:
         raise HTTPException(status_code=400, detail="Only MP3, WAV, MP4, or MOV files are supported")
+
+    # Validate preset and language hint
+    if preset not in TRANSCRIPTION_PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unknown preset '{preset}'. Choose from: {', '.join(TRANSCRIPTION_PRESETS)}")
+    try:
+        normalize_language(language)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Generate a unique filename (so that there are no conflicts)
     file_extension = os.path.splitext(file.filename)[1]
@@ -46,9 +64,21 @@ async def transcribe_audio(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
 
+    # Probe the media duration (the cost of the request) before doing any heavy work
+    try:
+        duration = await run_in_threadpool(probe_media_duration, file_path)
+    except Exception as e:
+        os.remove(file_path)
+        raise HTTPException(status_code=400, detail=f"Invalid media file: {str(e)}")
+
     # Process the media file to transcribe VTT file for subtitles, and get path to media file
     try:
-        vtt_file_path, media_file_path = process_media_file(file_path, use_api)
+        # Wait for capacity (shortest jobs first), then run in a worker thread so a client disconnect can cancel ffmpeg / Whisper mid-way
+        model = None if use_api else TRANSCRIPTION_PRESETS[preset]["model_size"]     # the API needs no local model
+        async with transcription_scheduler.admit(duration, model, request):
+            vtt_file_path, media_file_path, stats = await run_until_disconnected(
+                request, process_media_file, file_path, use_api, use_vad, preset, language
+            )
 
         # Get the filenames only (without the directory path)
         vtt_filename = os.path.basename(vtt_file_path)
@@ -63,13 +93,48 @@ async def transcribe_audio(
             "media_filename": media_filename,
             "vtt_file_path": vtt_file_path,
             "vtt_filename": vtt_filename,
+            "stats": stats,
         }
+    except AdmissionRejected as e:
+        # Over capacity: tell the client when to try again
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ProcessingCancelled:
+        # Client disconnected: remove the uploaded file, nobody is waiting for the result
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=499, detail="Transcription cancelled: client disconnected")
     except Exception as e:
         # Clean up the uploaded file if there was an error during processing
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Transcription error: {str(e)}")   # Error message
     
+@router.get("/transcribe/presets")    # /api/v1/transcribe/presets
+async def list_transcription_presets():
+    """
+    Endpoint to list the transcription presets and their recorded performance.
+    
+    Returns:
+        JSON with each preset's settings, average latency and real-time factor
+    """
+    metrics = get_preset_metrics()
+    return {
+        preset: {**options, **metrics[preset]}
+        for preset, options in TRANSCRIPTION_PRESETS.items()
+    }
+    
+@router.get("/queue/")    # /api/v1/queue
+async def get_queue_state():
+    """
+    Endpoint to monitor the transcription queue.
+    
+    Returns:
+        JSON with the in-flight and waiting jobs, their costs (audio seconds) and capacity limits
+    """
+    return transcription_scheduler.get_state()
+    
 @router.get("/media/{media_filename}")    # /api/v1/media/{media_filename}
 async def download_media(media_filename: str):
     """
@@ -119,6 +184,7 @@ async def download_vtt(vtt_filename: str):
 
 @router.post("/translate/")     # /api/v1/translate
 async def translate_subtitles(
+    request: Request,
     file: Optional[UploadFile] = File(None),      # File to be translated (optional)
     filename: Optional[str] = Form(None),         # Name of the file (optional)
     source_language: Optional[str] = Form(None),  # Source language of the subtitles (optional)
@@ -159,7 +225,10 @@ async def translate_subtitles(
 
     # Translate the media file from source language (if provided) to target language
     try:
-        translated_vtt_file_path = process_vtt_file(file_path, source_language, target_language)
+        # Run in a worker thread so a client disconnect can abort the Gemini request
+        translated_vtt_file_path = await run_until_disconnected(
+            request, process_vtt_file, file_path, source_language, target_language
+        )
         translated_vtt_filename = os.path.basename(translated_vtt_file_path)
 
         print("DEBUG: routes.py: translated_file_path:", translated_vtt_file_path)
@@ -169,12 +238,110 @@ async def translate_subtitles(
             "translated_vtt_file_path": translated_vtt_file_path,
             "translated_vtt_filename": translated_vtt_filename,
         }
+    except ProcessingCancelled:
+        # Client disconnected: remove the uploaded file, nobody is waiting for the result
+        if file and os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=499, detail="Translation cancelled: client disconnected")
     except Exception as e:
         # Clean up the uploaded file if there was an error during processing
         if file and os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Translation error: {str(e)}")
 
+@router.post("/transcribe-translate/")   # /api/v1/transcribe-translate
+async def transcribe_and_translate(
+    request: Request,
+    file: UploadFile = File(...),                   # File to be transcribed (required)
+    target_language: str = Form(...),               # Target language for translation (required)
+    source_language: str = Form("detect"),          # Language of the audio (default: detect)
+    use_vad: bool = Form(False),                    # Skip silence/non-speech before transcribing (default: False)
+    preset: str = Form(DEFAULT_PRESET),             # Speed/accuracy preset for the local model (default: "balanced")
+):
+    """
+    Endpoint to transcribe a media file and translate its subtitles in a single request.
+    Translation of finished segments overlaps with transcription of the rest of the file.
+    
+    Args:
+        file: The audio / video file to transcribe
+        target_language: Target language for translation
+        source_language: Language of the audio (ex. "en"); if "detect", Whisper detects it
+        use_vad: Whether to run a voice activity detection pre-pass so only speech is sent to Whisper
+        preset: Speed/accuracy preset ("fast", "balanced", "accurate") for the Whisper model
+    
+    Returns:
+        JSON with the source-language and translated VTT file paths
+    """
+
+    # Validate file type
+    if file.content_type not in ["audio/mpeg", "audio/wav", "video/mp4", "video/quicktime"]:
+        raise HTTPException(status_code=400, detail="Only MP3, WAV, MP4, or MOV files are supported")
+
+    # Validate preset and languages up front, before any transcription work is done
+    if preset not in TRANSCRIPTION_PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unknown preset '{preset}'. Choose from: {', '.join(TRANSCRIPTION_PRESETS)}")
+    if source_language not in LANGUAGE_CODE_TO_NAME or target_language not in LANGUAGE_CODE_TO_NAME or target_language == "detect":
+        raise HTTPException(status_code=400, detail="Unsupported source or target language")
+    try:
+        normalize_language(source_language)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Generate a unique filename (so that there are no conflicts)
+    file_extension = os.path.splitext(file.filename)[1]
+    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
+
+    # Save audio / video file
+    try:
+        with open(file_path, "wb") as buffer:
+            content = await file.read()
+            buffer.write(content)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+
+    # Probe the media duration (the cost of the request) before doing any heavy work
+    try:
+        duration = await run_in_threadpool(probe_media_duration, file_path)
+    except Exception as e:
+        os.remove(file_path)
+        raise HTTPException(status_code=400, detail=f"Invalid media file: {str(e)}")
+
+    try:
+        # Wait for capacity (shortest jobs first), then run in a worker thread so a client disconnect can cancel ffmpeg / Whisper / Gemini mid-way
+        async with transcription_scheduler.admit(duration, TRANSCRIPTION_PRESETS[preset]["model_size"], request):
+            vtt_file_path, translated_vtt_file_path, media_file_path, stats = await run_until_disconnected(
+                request, process_media_file_with_translation, file_path, source_language, target_language, use_vad, preset
+            )
+
+        print("DEBUG: routes.py: vtt_file_path:", vtt_file_path, "translated_vtt_file_path:", translated_vtt_file_path)
+
+        return {
+            "message": "Transcription and translation processed successfully",
+            "media_file_path": media_file_path,
+            "media_filename": os.path.basename(media_file_path),
+            "vtt_file_path": vtt_file_path,
+            "vtt_filename": os.path.basename(vtt_file_path),
+            "translated_vtt_file_path": translated_vtt_file_path,
+            "translated_vtt_filename": os.path.basename(translated_vtt_file_path),
+            "stats": stats,
+        }
+    except AdmissionRejected as e:
+        # Over capacity: tell the client when to try again
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ProcessingCancelled:
+        # Client disconnected: remove the uploaded file, nobody is waiting for the result
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=499, detail="Transcription cancelled: client disconnected")
+    except Exception as e:
+        # Clean up the uploaded file if there was an error during processing
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=500, detail=f"Transcription / translation error: {str(e)}")
+
 @router.post("/clear-uploads/")   # /api/v1/clear-uploads
 async def clear_uploads_directory():
     """
@@ -25,6 +25,24 @@ class Settings(BaseSettings):
 
     # Upload settings
     UPLOAD_DIR: str = "uploads"
+
+    # Voice activity detection (silence skipping before Whisper)
+    VAD_AGGRESSIVENESS: int = 2         # 0 (least) to 3 (most aggressive at filtering out non-speech)
+    VAD_MIN_SILENCE_MS: int = 500       # pauses shorter than this are kept inside a speech region
+    VAD_MIN_SPEECH_MS: int = 250        # speech bursts shorter than this are dropped
+    VAD_SPEECH_PAD_MS: int = 200        # padding kept around each speech region
+
+    # Combined transcribe + translate pipeline
+    PIPELINE_CHUNK_SECONDS: int = Field(default=60, gt=0)     # audio transcribed per Whisper call before its segments are handed on
+    PIPELINE_BATCH_SEGMENTS: int = 20                          # segments sent to the translation model per request
+    PIPELINE_TRANSLATION_WORKERS: int = 2                      # translation requests allowed in flight at once
+    PIPELINE_TRANSLATION_ATTEMPTS: int = 2                     # tries per batch before failing if cues come back altered
+
+    # Transcription admission control (costs are measured in seconds of audio)
+    SCHEDULER_MAX_INFLIGHT_AUDIO_SECONDS: float = 3600.0    # total audio being transcribed at once
+    SCHEDULER_MAX_QUEUED_AUDIO_SECONDS: float = 4 * 3600.0  # total audio allowed to wait; beyond this requests get 429
+    SCHEDULER_AGING_RATE: float = 10.0                      # priority gained (audio-seconds) per second waited
+    SCHEDULER_DEFAULT_THROUGHPUT: float = 2.0               # initial guess of audio-seconds transcribed per second (all jobs)
     
     # Database
     DATABASE_URL: str = Field(default="", env="DATABASE_URL")   # put database url here!!!
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+from typing import Callable, Optional
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+class ProcessingCancelled(Exception):
+    """Raised inside a processing stage when the client disconnected and the work should stop."""
+
+class LinkedCancelEvent(threading.Event):
+    """Cancel event for a sub-task that is also considered set once its parent event is set."""
+    def __init__(self, parent: Optional[threading.Event] = None):
+        super().__init__()
+        self.parent = parent
+
+    def is_set(self) -> bool:
+        return super().is_set() or (self.parent is not None and self.parent.is_set())
+
+def raise_if_cancelled(cancel_event: Optional[threading.Event]):
+    """
+    Stop the current processing stage if its request was cancelled.
+
+    Args:
+        cancel_event: Event set when the client disconnects (None if the work is not cancellable)
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise ProcessingCancelled("Client disconnected")
+
+async def run_until_disconnected(request: Request, func: Callable, *args, poll_interval: float = 0.5):
+    """
+    Run blocking processing work in a worker thread, cancelling it if the client disconnects.
+
+    The function is called with a `cancel_event` keyword argument that is set once the client
+    goes away; it is expected to check it between stages, stop early and clean up after itself.
+
+    Args:
+        request: The incoming request (polled for client disconnects)
+        func: Blocking function to run
+        *args: Positional arguments for func
+        poll_interval: How often (seconds) to check whether the client is still connected
+
+    Returns:
+        The return value of func
+    """
+    cancel_event = threading.Event()
+    task = asyncio.ensure_future(run_in_threadpool(func, *args, cancel_event=cancel_event))
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=poll_interval)
+            if not task.done() and await request.is_disconnected():
+                print("DEBUG: cancellation.py: client disconnected, cancelling", func.__name__)
+                cancel_event.set()
+                break
+        # Wait for the worker to reach its next checkpoint (raises ProcessingCancelled if it stopped early)
+        return await task
+    except asyncio.CancelledError:
+        cancel_event.set()  # e.g. server shutdown; the worker thread cannot be interrupted otherwise
+        raise
@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from app.core.config import settings
+from app.services.cancellation import LinkedCancelEvent, raise_if_cancelled
+from app.services.transcription import (
+    get_audio_path, iter_transcribed_segments, format_vtt_cues, generate_vtt_from_transcription,
+    normalize_language, DEFAULT_PRESET, WHISPER_LANGUAGE_ALIASES,
+)
+from app.services.translation import translate_vtt_cues, create_vtt_from_translated_string, LANGUAGE_CODE_TO_NAME
+
+def get_prompt_language(source_language: str, detected_language: Optional[str]) -> str:
+    """
+    Pick the source language for translation prompts, preferring the language Whisper detected.
+    
+    Args:
+        source_language: Language requested by the client (if "detect" then detect)
+        detected_language: Whisper language code detected on the first chunk (None if not known yet)
+        
+    Returns:
+        Language code understood by the translation prompt ("detect" if Whisper's code has no equivalent, ex. "zh")
+    """
+    if source_language != "detect" or detected_language is None:
+        return source_language
+    # Map Whisper's spelling back to the translation code (ex. "jw" -> "jv")
+    for code, whisper_code in WHISPER_LANGUAGE_ALIASES.items():
+        if detected_language == whisper_code:
+            detected_language = code
+    return detected_language if detected_language in LANGUAGE_CODE_TO_NAME else "detect"
+
+def process_media_file_with_translation(
+    file_path: str,
+    source_language: str,
+    target_language: str,
+    use_vad: bool = False,
+    preset: str = DEFAULT_PRESET,
+    cancel_event: Optional[threading.Event] = None,
+) -> tuple[str, str, str, dict]:
+    """
+    Transcribe a media file and translate its subtitles in one pass.
+
+    Batches of finished segments are sent for translation while Whisper is still working
+    on later audio, so the total time is close to the slower of the two stages.
+
+    Args:
+        file_path: Path to the media file (audio or video)
+        source_language: Language of the audio (if "detect" then detect)
+        target_language: Target language for translation
+        use_vad: Whether to skip silence/non-speech before transcribing
+        preset: Speed/accuracy preset for the local model (see TRANSCRIPTION_PRESETS)
+        cancel_event: Event set when the client disconnects; stops processing (optional)
+
+    Returns:
+        Tuple of (vtt_file_path, translated_vtt_file_path, media_file_path, stats)
+    """
+    process_start = time.perf_counter()
+
+    # Stops the translation batches if the client disconnects or any stage fails
+    stop_event = LinkedCancelEvent(cancel_event)
+
+    audio_path = get_audio_path(file_path, cancel_event)
+    vtt_path = os.path.splitext(file_path)[0] + ".vtt"
+    translated_vtt_path = None
+
+    prompt_language = source_language
+    segments = []       # all transcribed segments, in order
+    pending = []        # segments not yet sent for translation
+    batches = []        # futures of translated cues, in order
+    executor = ThreadPoolExecutor(max_workers=settings.PIPELINE_TRANSLATION_WORKERS)
+
+    def submit_pending():
+        # Cue numbers continue from the previous batch so the translated batches can simply be joined
+        vtt_cues = format_vtt_cues(pending, start_index=len(segments) + 1)
+        batches.append(executor.submit(translate_vtt_cues, vtt_cues, prompt_language, target_language, stop_event))
+        segments.extend(pending)
+        pending.clear()
+
+    try:
+        # Transcribe chunk by chunk, handing full batches over to translation as they are ready
+        for chunk_segments, transcription_stats in iter_transcribed_segments(
+            audio_path, preset, normalize_language(source_language), use_vad, settings.PIPELINE_CHUNK_SECONDS, cancel_event
+        ):
+            # Whisper detects the language on the first chunk, so the batch prompts don't need to detect it again
+            prompt_language = get_prompt_language(source_language, transcription_stats["timing"]["language"])
+            pending.extend(chunk_segments)
+            if len(pending) >= settings.PIPELINE_BATCH_SEGMENTS:
+                submit_pending()
+
+            # Fail early if a translation batch already failed, rather than after all of Whisper is done
+            for batch in batches:
+                if batch.done() and batch.exception() is not None:
+                    raise batch.exception()
+        if pending:
+            submit_pending()
+        transcribe_seconds = time.perf_counter() - process_start
+
+        # The source-language VTT is written while the last batches are still being translated
+        generate_vtt_from_transcription({"segments": segments}, vtt_path)
+
+        translation_wait_start = time.perf_counter()
+        translated_cues = "".join(batch.result() for batch in batches)
+        translation_wait_seconds = time.perf_counter() - translation_wait_start
+
+        raise_if_cancelled(cancel_event)
+        translated_vtt_path = create_vtt_from_translated_string(f"WEBVTT\n\n{translated_cues}", vtt_path, target_language)
+    except Exception:
+        # Stop the remaining batches and remove everything this request produced (the uploaded file is removed by the caller)
+        stop_event.set()
+        for path in [vtt_path, translated_vtt_path, audio_path if audio_path != file_path else None]:
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)    # running batches stop on stop_event
+
+    stats = {
+        "total_seconds": round(time.perf_counter() - process_start, 3),
+        "transcribe_seconds": round(transcribe_seconds, 3),
+        "translation_wait_seconds": round(translation_wait_seconds, 3),     # time spent on translation after transcription finished
+        "translation_batches": len(batches),
+    }
+    stats["transcription"] = transcription_stats["timing"]
+    if "vad" in transcription_stats:
+        stats["vad"] = transcription_stats["vad"]
+
+    return vtt_path, str(translated_vtt_path), file_path, stats
@@ -0,0 +1,208 @@
+import asyncio
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import Request
+from app.core.config import settings
+from app.services.cancellation import ProcessingCancelled
+
+class AdmissionRejected(Exception):
+    """Raised when the transcription queue is full; retry_after is the estimated wait in seconds."""
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server is at capacity, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+class TranscriptionJob:
+    """A transcription request waiting for (or holding) a share of the processing capacity."""
+    def __init__(self, cost: float, model: Optional[str] = None):
+        self.id = str(uuid.uuid4())
+        self.cost = cost                    # audio duration in seconds
+        self.model = model                  # Whisper model size the job runs on (None if it needs no local model)
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.admitted = asyncio.get_running_loop().create_future()
+
+class TranscriptionScheduler:
+    """
+    Cost-aware admission control for transcription requests.
+
+    Caps the total audio-seconds being processed at once, runs the shortest waiting job first,
+    and ages waiting jobs so long ones are never starved. A shared Whisper model only transcribes
+    one file at a time, so each model is given to one job at a time: admitted jobs really run,
+    instead of queueing on the model's lock outside the scheduler's ordering.
+    All methods run on the event loop thread.
+    """
+    def __init__(self, max_inflight_seconds: float, max_queued_seconds: float, aging_rate: float, default_throughput: float):
+        self.max_inflight_seconds = max_inflight_seconds
+        self.max_queued_seconds = max_queued_seconds
+        self.aging_rate = aging_rate        # audio-seconds of priority gained per second spent waiting
+        self.default_throughput = default_throughput    # used until a job has completed
+        self.inflight = {}                  # job id -> TranscriptionJob
+        self.waiting = []                   # TranscriptionJob list, in arrival order
+        self.completed = 0
+        self.rejected = 0
+        self.completed_seconds = 0.0        # audio-seconds of successfully completed jobs
+        self.busy_seconds = 0.0             # wall-seconds during which at least one job was in flight
+        self.last_tick = time.monotonic()
+
+    def inflight_seconds(self) -> float:
+        return sum(job.cost for job in self.inflight.values())
+
+    def queued_seconds(self) -> float:
+        return sum(job.cost for job in self.waiting)
+
+    def tick(self, now: float):
+        # Count busy time before the set of in-flight jobs changes
+        if self.inflight:
+            self.busy_seconds += now - self.last_tick
+        self.last_tick = now
+
+    def throughput(self) -> float:
+        """
+        Observed audio-seconds completed per wall-second while busy, across all jobs
+        (concurrent jobs share the CPU, so this does not grow with the number of jobs).
+        """
+        if self.completed_seconds and self.busy_seconds:
+            return self.completed_seconds / self.busy_seconds
+        return self.default_throughput
+
+    def priority(self, job: TranscriptionJob, now: float) -> float:
+        """
+        Effective priority of a waiting job (lower runs first): its cost minus credit for time spent waiting.
+        """
+        return job.cost - self.aging_rate * (now - job.enqueued_at)
+
+    def fits(self, cost: float) -> bool:
+        # A job larger than the whole budget may still run, but only on its own
+        return not self.inflight or self.inflight_seconds() + cost <= self.max_inflight_seconds
+
+    def estimate_wait(self, cost: float) -> int:
+        """
+        Estimate how long (seconds) until a job of this cost could be queued, based on the observed throughput.
+        """
+        excess = max(0.0, self.queued_seconds() + min(cost, self.max_queued_seconds) - self.max_queued_seconds)
+        return max(1, math.ceil((self.inflight_seconds() + excess) / self.throughput()))
+
+    def dispatch(self):
+        """
+        Start waiting jobs in priority order for as long as they fit in the in-flight budget
+        and their Whisper model is free.
+        """
+        now = time.monotonic()
+        self.tick(now)
+        busy_models = {job.model for job in self.inflight.values() if job.model is not None}
+        for job in sorted(self.waiting, key=lambda waiting_job: self.priority(waiting_job, now)):
+            if job.model in busy_models:
+                # Later jobs for the same model stay behind this one (they are marked busy from here on)
+                continue
+            if not self.fits(job.cost):
+                break   # don't let smaller jobs jump ahead of the head of the queue, or aging could never help it
+            self.waiting.remove(job)
+            job.started_at = now
+            self.inflight[job.id] = job
+            if job.model is not None:
+                busy_models.add(job.model)
+            job.admitted.set_result(True)
+
+    async def acquire(self, cost: float, model: Optional[str] = None, request: Optional[Request] = None, poll_interval: float = 0.5) -> TranscriptionJob:
+        """
+        Wait for capacity to process a job of the given cost.
+
+        Args:
+            cost: Audio duration of the job in seconds
+            model: Whisper model size the job will run on (one job per model at a time)
+            request: The incoming request; if the client disconnects while queued, the job is dropped (optional)
+            poll_interval: How often (seconds) to check whether the client is still connected
+
+        Returns:
+            The admitted job (pass it to release when done)
+        """
+        # An empty wait queue always takes the job (aging will bring it to the head); otherwise cap
+        # its cost at the queue budget so jobs longer than the budget are not rejected forever
+        if self.waiting and self.queued_seconds() + min(cost, self.max_queued_seconds) > self.max_queued_seconds:
+            self.rejected += 1
+            raise AdmissionRejected(self.estimate_wait(cost))
+
+        job = TranscriptionJob(cost, model)
+        self.waiting.append(job)
+        self.dispatch()
+        try:
+            while not job.admitted.done():
+                await asyncio.wait({job.admitted}, timeout=poll_interval)
+                if not job.admitted.done() and request is not None and await request.is_disconnected():
+                    raise ProcessingCancelled("Client disconnected")
+        except BaseException:
+            if job in self.waiting:
+                self.waiting.remove(job)
+            else:
+                self.release(job)
+            raise
+        return job
+
+    def release(self, job: TranscriptionJob, succeeded: bool = False):
+        """
+        Free a job's capacity and start the next waiting jobs.
+
+        Args:
+            job: The admitted job
+            succeeded: Whether the job ran to completion (only then does it count towards the throughput)
+        """
+        if job.id not in self.inflight:
+            return
+        self.tick(time.monotonic())
+        del self.inflight[job.id]
+        if succeeded:
+            self.completed += 1
+            self.completed_seconds += job.cost
+        self.dispatch()
+
+    @asynccontextmanager
+    async def admit(self, cost: float, model: Optional[str] = None, request: Optional[Request] = None):
+        """
+        Hold a share of the processing capacity for the duration of the block.
+
+        Raises:
+            AdmissionRejected: If the queue is full
+            ProcessingCancelled: If the client disconnects while queued
+        """
+        job = await self.acquire(cost, model, request)
+        try:
+            yield job
+        except BaseException:
+            self.release(job)
+            raise
+        self.release(job, succeeded=True)
+
+    def get_state(self) -> dict:
+        """
+        Snapshot of the queue for monitoring.
+        """
+        now = time.monotonic()
+        waiting = sorted(self.waiting, key=lambda job: self.priority(job, now))
+        return {
+            "max_inflight_seconds": self.max_inflight_seconds,
+            "max_queued_seconds": self.max_queued_seconds,
+            "inflight_seconds": round(self.inflight_seconds(), 3),
+            "queued_seconds": round(self.queued_seconds(), 3),
+            "throughput": round(self.throughput(), 3),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "inflight": [
+                {"id": job.id, "cost": round(job.cost, 3), "model": job.model, "running_seconds": round(now - job.started_at, 3)}
+                for job in self.inflight.values()
+            ],
+            "waiting": [
+                {"id": job.id, "cost": round(job.cost, 3), "model": job.model, "waiting_seconds": round(now - job.enqueued_at, 3), "priority": round(self.priority(job, now), 3)}
+                for job in waiting
+            ],
+        }
+
+# Shared scheduler for all transcription endpoints
+transcription_scheduler = TranscriptionScheduler(
+    max_inflight_seconds=settings.SCHEDULER_MAX_INFLIGHT_AUDIO_SECONDS,
+    max_queued_seconds=settings.SCHEDULER_MAX_QUEUED_AUDIO_SECONDS,
+    aging_rate=settings.SCHEDULER_AGING_RATE,
+    default_throughput=settings.SCHEDULER_DEFAULT_THROUGHPUT,
+)
@@ -4,25 +4,350 @@ import whisper
 import ffmpeg
 import time
 import subprocess
+import threading
+import numpy as np
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Iterator
+from whisper.audio import SAMPLE_RATE
+from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
 from app.core.config import settings
+from app.services.vad import detect_speech_regions, collect_speech_audio, remap_transcription, get_vad_stats
+from app.services.cancellation import ProcessingCancelled, raise_if_cancelled
+
+# Named speed/accuracy presets: Whisper model size + decoding options passed to model.transcribe
+TRANSCRIPTION_PRESETS = {
+    "fast": {
+        "model_size": "tiny",
+        "beam_size": None,                      # greedy decoding
+        "best_of": 1,
+        "temperature": 0.0,                     # no temperature fallback
+        "condition_on_previous_text": False,    # faster, and avoids repetition loops
+    },
+    "balanced": {
+        "model_size": "base",
+        "beam_size": None,
+        "best_of": 5,
+        "temperature": (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        "condition_on_previous_text": True,
+    },
+    "accurate": {
+        "model_size": "small",
+        "beam_size": 5,                         # beam search
+        "best_of": 5,
+        "temperature": (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        "condition_on_previous_text": True,
+    },
+}
+DEFAULT_PRESET = "balanced"
+
+# Language codes the frontend uses that Whisper spells differently
+WHISPER_LANGUAGE_ALIASES = {
+    "jv": "jw",     # Javanese
+}
+
+# Running latency / real-time factor totals per preset (in-memory, reset on restart)
+_preset_metrics = {preset: {"runs": 0, "audio_seconds": 0.0, "inference_seconds": 0.0} for preset in TRANSCRIPTION_PRESETS}
+_preset_metrics_lock = threading.Lock()
+
+# Cancel event of the transcription running on the current thread (models are shared between requests)
+_cancellation = threading.local()
+
+@lru_cache(maxsize=None)
+def load_whisper_model(model_size: str):
+    """
+    Load a Whisper model once and reuse it across requests.
+    
+    The decoder keeps its kv-cache in hooks on the model itself, so concurrent runs on one
+    instance would corrupt each other; hold the model (hold_model) around model.transcribe.
+    
+    Args:
+        model_size: Size of the Whisper model to load ("tiny", "base", "small", "medium", "large")
+        
+    Returns:
+        The loaded Whisper model
+    """
+    model = whisper.load_model(model_size)
+
+    # Only one transcription at a time per model instance
+    model.transcribe_lock = threading.Lock()
+
+    # model.transcribe calls model.decode once per 30 second window, so check for cancellation there
+    decode = model.decode
+    def decode_unless_cancelled(*args, **kwargs):
+        raise_if_cancelled(getattr(_cancellation, "event", None))
+        return decode(*args, **kwargs)
+    model.decode = decode_unless_cancelled
+
+    return model
+
+@contextmanager
+def hold_model(model, cancel_event: Optional[threading.Event] = None):
+    """
+    Wait for exclusive use of a shared Whisper model, giving up if the request is cancelled.
+    
+    Args:
+        model: Whisper model from load_whisper_model
+        cancel_event: Event set when the client disconnects (optional)
+    """
+    while not model.transcribe_lock.acquire(timeout=0.5):
+        raise_if_cancelled(cancel_event)
+    try:
+        raise_if_cancelled(cancel_event)    # don't start on the mel spectrogram / language detection if cancelled while waiting
+        yield model
+    finally:
+        model.transcribe_lock.release()
+
+def run_ffmpeg(cmd: List[str], cancel_event: Optional[threading.Event] = None) -> bytes:
+    """
+    Run an FFmpeg command, killing the child process if the request is cancelled.
+    
+    Args:
+        cmd: FFmpeg command line arguments
+        cancel_event: Event set when the client disconnects (optional)
+        
+    Returns:
+        The stdout output of FFmpeg
+    """
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel_event is not None and cancel_event.is_set():
+                print("DEBUG: transcription.py: killing FFmpeg process", process.pid)
+                process.kill()
+                process.communicate()
+                raise ProcessingCancelled("Client disconnected")
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return stdout
+
+def load_audio(audio_path: str, cancel_event: Optional[threading.Event] = None) -> np.ndarray:
+    """
+    Decode an audio file into the mono 16kHz float32 array Whisper expects (same as whisper.load_audio, but cancellable).
+    
+    Args:
+        audio_path: Path to the audio file
+        cancel_event: Event set when the client disconnects (optional)
+        
+    Returns:
+        Audio samples normalized to [-1, 1]
+    """
+    cmd = [
+        'ffmpeg',
+        '-nostdin',
+        '-threads', '0',
+        '-i', audio_path,           # input audio file
+        '-f', 's16le',              # raw 16-bit PCM output
+        '-ac', '1',                 # mono
+        '-acodec', 'pcm_s16le',
+        '-ar', str(SAMPLE_RATE),    # 16kHz
+        '-'                         # write to stdout
+    ]
+    try:
+        out = run_ffmpeg(cmd, cancel_event)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"Error loading audio with ffmpeg: {e.stderr.decode() if e.stderr else str(e)}")
+
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+def normalize_language(language: Optional[str]) -> Optional[str]:
+    """
+    Convert a source-language hint into a Whisper language code.
+    
+    Args:
+        language: Language code (ex. "en", "zh-CN") or name (ex. "English"); None, "" or "detect" to auto-detect
+        
+    Returns:
+        Whisper language code, or None to let Whisper detect the language
+    """
+    if not language or language.lower() in ["detect", "auto"]:
+        return None
+
+    language = language.lower()
+    code = language.split("-")[0]   # Whisper does not distinguish regional variants (ex. "zh-cn" -> "zh")
+    code = WHISPER_LANGUAGE_ALIASES.get(code, code)
+    if code in LANGUAGES:
+        return code
+    if language in TO_LANGUAGE_CODE:
+        return TO_LANGUAGE_CODE[language]
+    raise ValueError(f"Unsupported language: {language}")
+
+def record_preset_metrics(preset: str, audio_seconds: float, inference_seconds: float):
+    """
+    Add one transcription run to the running totals for a preset.
+    """
+    with _preset_metrics_lock:
+        metrics = _preset_metrics[preset]
+        metrics["runs"] += 1
+        metrics["audio_seconds"] += audio_seconds
+        metrics["inference_seconds"] += inference_seconds
+
+def get_preset_metrics() -> dict:
+    """
+    Get the average latency and real-time factor recorded for each preset.
+    
+    Returns:
+        Dictionary of preset name -> runs, average latency (seconds) and real-time factor
+    """
+    with _preset_metrics_lock:
+        return {
+            preset: {
+                "runs": metrics["runs"],
+                "avg_latency_seconds": round(metrics["inference_seconds"] / metrics["runs"], 3) if metrics["runs"] else None,
+                "real_time_factor": round(metrics["inference_seconds"] / metrics["audio_seconds"], 4) if metrics["audio_seconds"] else None,
+            }
+            for preset, metrics in _preset_metrics.items()
+        }
+
+def find_chunk_boundaries(audio: np.ndarray, chunk_seconds: Optional[float], search_seconds: float = 5.0) -> List[Tuple[int, int]]:
+    """
+    Split an audio clip into chunks of about chunk_seconds, cutting at the quietest point near each boundary.
+    
+    Args:
+        audio: Mono float32 audio sampled at 16kHz
+        chunk_seconds: Target chunk length in seconds (None for a single chunk)
+        search_seconds: How far before each boundary to look for a quiet cut point (at most half a chunk)
+        
+    Returns:
+        List of (start_sample, end_sample) chunks covering the whole clip
+    """
+    if chunk_seconds is None:
+        return [(0, len(audio))]
+    if chunk_seconds <= 0:
+        raise ValueError("chunk_seconds must be positive")
+
+    chunk_length = max(1, int(chunk_seconds * SAMPLE_RATE))
+    search_length = min(int(search_seconds * SAMPLE_RATE), chunk_length // 2)   # never search back past the chunk start
+    window = SAMPLE_RATE // 10  # 100ms energy windows
+
+    boundaries = []
+    start = 0
+    while len(audio) - start > chunk_length:
+        if search_length < window:
+            end = start + chunk_length  # chunk too short to search for a quiet point
+        else:
+            # Cut in the 100ms window with the least energy so words are not split between chunks
+            search_start = start + chunk_length - search_length
+            search = audio[search_start:start + chunk_length]
+            energies = np.square(search[:len(search) // window * window]).reshape(-1, window).mean(axis=1)
+            end = search_start + int(np.argmin(energies)) * window + window // 2
+        boundaries.append((start, end))
+        start = end
+    boundaries.append((start, len(audio)))
+
+    return boundaries
+
+def iter_transcribed_segments(audio_path: str, preset: str = DEFAULT_PRESET, language: Optional[str] = None, use_vad: bool = False, chunk_seconds: Optional[float] = None, cancel_event: Optional[threading.Event] = None) -> Iterator[Tuple[List[dict], dict]]:
+    """
+    Transcribe audio with the local Whisper model chunk by chunk, yielding segments as soon as each chunk is done.
+    
+    Lets later stages (ex. translation) start before the whole file is transcribed.
+    
+    Args:
+        audio_path: Path to the audio file
+        preset: Name of the speed/accuracy preset to use (see TRANSCRIPTION_PRESETS)
+        language: Whisper language code of the audio; skips language detection if provided
+        use_vad: Whether to skip silence/non-speech with a VAD pre-pass before running Whisper
+        chunk_seconds: Length of audio transcribed per Whisper call (None to transcribe everything in one call)
+        cancel_event: Event set when the client disconnects; inference stops at the next 30 second window (optional)
+        
+    Yields:
+        Tuple of (segments, stats) for each chunk: the chunk's segments (timestamps on the original timeline),
+        and the timing (and VAD) stats so far, including the detected language
+    """
+    options = dict(TRANSCRIPTION_PRESETS[preset])
+    model_size = options.pop("model_size")
+
+    # Load the Whisper model (cached after the first request) and the audio
+    model = load_whisper_model(model_size)
+    audio = load_audio(audio_path, cancel_event)
+    audio_seconds = len(audio) / SAMPLE_RATE
+
+    stats = {}
+    inference_start = time.perf_counter()
+    speech_audio, offsets = audio, []
+    if use_vad:
+        # Only send the speech regions to Whisper, then map the timestamps back onto the original timeline
+        regions = detect_speech_regions(audio)
+        speech_audio, offsets = collect_speech_audio(audio, regions)
+        stats["vad"] = get_vad_stats(audio, regions)
+
+        print("DEBUG: transcription.py: VAD stats:", stats["vad"])
+    inference_seconds = time.perf_counter() - inference_start
+
+    previous_text = ""
+    for start, end in find_chunk_boundaries(speech_audio, chunk_seconds):
+        raise_if_cancelled(cancel_event)
+        segments = []
+        if end > start:     # otherwise no speech was found
+            # Carry the previous chunk's text over as the prompt, like Whisper does between its own windows
+            initial_prompt = previous_text[-200:] if options["condition_on_previous_text"] and previous_text else None
+
+            with hold_model(model, cancel_event):
+                # Start timing once the model is ours, so waiting for it is not counted as inference
+                chunk_start = time.perf_counter()
+                _cancellation.event = cancel_event
+                try:
+                    result = model.transcribe(speech_audio[start:end], language=language, initial_prompt=initial_prompt, **options)
+                finally:
+                    _cancellation.event = None
+                inference_seconds += time.perf_counter() - chunk_start
+            language = result.get("language") or language   # only detect the language on the first chunk
+            previous_text = result["text"]
+
+            # Shift the chunk's timestamps onto the speech clip, then onto the original timeline
+            chunk_offset = start / SAMPLE_RATE
+            for segment in result["segments"]:
+                segment["start"] += chunk_offset
+                segment["end"] += chunk_offset
+            if use_vad:
+                remap_transcription(result, offsets)
+            segments = result["segments"]
+
+        # Latency and real-time factor (inference time / audio duration) so far
+        stats["timing"] = {
+            "preset": preset,
+            "model_size": model_size,
+            "language": language,
+            "audio_seconds": round(audio_seconds, 3),
+            "inference_seconds": round(inference_seconds, 3),
+            "real_time_factor": round(inference_seconds / audio_seconds, 4) if audio_seconds else None,
+        }
+        yield segments, stats
+
+    record_preset_metrics(preset, audio_seconds, inference_seconds)
 
 # Option 1: Local Whisper model
-def transcribe_audio_local(audio_path: str, model_size: str = "base") -> dict:
+def transcribe_audio_local(audio_path: str, preset: str = DEFAULT_PRESET, language: Optional[str] = None, use_vad: bool = False, cancel_event: Optional[threading.Event] = None) -> dict:
     """
     Transcribe audio using locally installed Whisper model.
     
     Args:
         audio_path: Path to the audio file
-        model_size: Size of the Whisper model to use ("tiny", "base", "small", "medium", "large")
+        preset: Name of the speed/accuracy preset to use (see TRANSCRIPTION_PRESETS)
+        language: Whisper language code of the audio; skips language detection if provided
+        use_vad: Whether to skip silence/non-speech with a VAD pre-pass before running Whisper
+        cancel_event: Event set when the client disconnects; inference stops at the next 30 second window (optional)
         
     Returns:
         Dictionary containing transcription data
     """
-    # Load the Whisper model and transcribe the audio
-    model = whisper.load_model(model_size)  # defaults to "base" for now, only requires 1GB RAM and is pretty fast
-    result = model.transcribe(audio_path)
+    # Whole file in a single Whisper call
+    segments = []
+    for chunk_segments, stats in iter_transcribed_segments(audio_path, preset, language, use_vad, None, cancel_event):
+        segments.extend(chunk_segments)
+
+    result = {
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+        "language": stats["timing"]["language"],
+    }
+    result.update(stats)    # "timing" (and "vad" if used)
     
     return result   # returns a dictionary with the transcription and other metadata
 
@@ -49,12 +374,13 @@ def transcribe_audio_local(audio_path: str, model_size: str = "base") -> dict:
     
 #     return response
 
-def extract_audio_from_video(video_path: str) -> str:
+def extract_audio_from_video(video_path: str, cancel_event: Optional[threading.Event] = None) -> str:
     """
     Extract audio from a video file using ffmpeg.
     
     Args:
         video_path: Path to the video file
+        cancel_event: Event set when the client disconnects; kills the ffmpeg process (optional)
         
     Returns:
         Path to the extracted audio file
@@ -74,7 +400,7 @@ def extract_audio_from_video(video_path: str) -> str:
             audio_path              # output audio file
         ]
         
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        run_ffmpeg(cmd, cancel_event)
         
         # If subprocess succeeds but file wasn't created, fall back to ffmpeg-python
         if not os.path.exists(audio_path):
@@ -86,6 +412,11 @@ def extract_audio_from_video(video_path: str) -> str:
                 .output(audio_path, acodec='libmp3lame', q='2')
                 .run(quiet=True, overwrite_output=True)
             )
+    except ProcessingCancelled:
+        # Remove the partially written audio file
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        raise
     except subprocess.CalledProcessError as e:
         raise Exception(f"Error extracting audio with ffmpeg: {e.stderr.decode() if e.stderr else str(e)}")
     except Exception as e:
@@ -147,6 +478,40 @@ def create_video_from_audio(audio_path: str) -> str:
     # Return the .mp4 video file
     return video_path
 
+def format_vtt_timestamp(seconds: float) -> str:
+    """
+    Format a time in seconds as a VTT timestamp (ex. 00:00:01.000).
+    """
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    secs = seconds % 60
+    return f"{hours:02d}:{minutes:02d}:{secs:06.3f}"#.replace(".", ",")
+
+def format_vtt_cues(segments: List[dict], start_index: int = 1) -> str:
+    """
+    Format Whisper segments as VTT cues (without the WEBVTT header).
+    
+    Args:
+        segments: Whisper segments with 'start', 'end' and 'text'
+        start_index: Number of the first cue
+        
+    Returns:
+        VTT cues as a string
+    """
+    cues = []
+    for i, segment in enumerate(segments, start=start_index):
+        start_time = format_vtt_timestamp(segment['start'])
+        end_time = format_vtt_timestamp(segment['end'])
+        text = segment['text'].strip()    # remove leading/trailing whitespace
+
+        # Format the segment in VTT format
+        cues.append(
+            f"{i}\n"                            # ex. 1
+            f"{start_time} --> {end_time}\n"    #     00:00:01.000 --> 00:00:05.000
+            f"{text}\n\n"                        #     Hello, world!
+        )
+    return "".join(cues)
+
 def generate_vtt_from_transcription(transcription: dict, output_path: Optional[str] = None) -> str:
     """
     Generate VTT subtitle file from Whisper transcription.
@@ -163,13 +528,6 @@ def generate_vtt_from_transcription(transcription: dict, output_path: Optional[s
         timestamp = int(time.time())
         output_path = os.path.join(settings.UPLOAD_DIR, f"subtitles_{timestamp}.vtt")
     
-    # Format timestamps for VTT
-    def format_timestamp(seconds: float) -> str:
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = seconds % 60
-        return f"{hours:02d}:{minutes:02d}:{secs:06.3f}"#.replace(".", ",")
-    
     # Write VTT file
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write("WEBVTT\n\n")
@@ -177,15 +535,7 @@ def generate_vtt_from_transcription(transcription: dict, output_path: Optional[s
         # Handle different output formats from Whisper
         if 'segments' in transcription: # make sure the dictionary has the key 'segments'
             # Local Whisper dictionary format
-            for i, segment in enumerate(transcription['segments']): 
-                start_time = format_timestamp(segment['start'])
-                end_time = format_timestamp(segment['end'])
-                text = segment['text'].strip()    # remove leading/trailing whitespace
-                
-                # Write the segment to the VTT file in VTT format
-                f.write(f"{i + 1}\n")                        # ex. 1 
-                f.write(f"{start_time} --> {end_time}\n")    #     00:00:01.000 --> 00:00:05.000
-                f.write(f"{text}\n\n")                       #     Hello, world!     
+            f.write(format_vtt_cues(transcription['segments']))
         # elif 'text' in transcription:
         #     # OpenAI API format - we'll need to split it into segments
         #     # Since API doesn't return timestamps, we'll create dummy ones
@@ -205,18 +555,44 @@ def generate_vtt_from_transcription(transcription: dict, output_path: Optional[s
     # Return the path to the generated VTT file
     return output_path
 
-def process_media_file(file_path: str, use_api: bool = False) -> tuple[str, str]:
+def probe_media_duration(file_path: str) -> float:
     """
-    Process a media file to generate subtitles.
+    Get the duration of a media file with ffprobe (without decoding it).
     
     Args:
         file_path: Path to the media file (audio or video)
-        use_api: Whether to use the OpenAI API (True) or local model (False)
         
     Returns:
-        Tuple of (transcription_result, vtt_file_path)
+        Duration in seconds
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration',             # only the container duration
+        '-of', 'default=noprint_wrappers=1:nokey=1',    # print the bare value
+        file_path
+    ]
+    try:
+        out = run_ffmpeg(cmd)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"Error probing media with ffprobe: {e.stderr.decode() if e.stderr else str(e)}")
+
+    try:
+        return float(out.decode().strip())
+    except ValueError:
+        raise Exception("Could not determine media duration")
+
+def get_audio_path(file_path: str, cancel_event: Optional[threading.Event] = None) -> str:
     """
+    Get the audio file to transcribe for a media file, extracting the audio track if it is a video.
     
+    Args:
+        file_path: Path to the media file (audio or video)
+        cancel_event: Event set when the client disconnects (optional)
+        
+    Returns:
+        Path to the audio file (the media file itself if it is already audio)
+    """
     # Determine if it's a video file that needs audio extraction or an audio file that does not
     file_ext = os.path.splitext(file_path)[1].lower()
     is_video = file_ext in ['.mp4', '.mov', '.avi', '.mkv']
@@ -224,23 +600,58 @@ def process_media_file(file_path: str, use_api: bool = False) -> tuple[str, str]
 
     # Extract audio if it's a video file
     if is_video:
-        audio_path = extract_audio_from_video(file_path)
+        return extract_audio_from_video(file_path, cancel_event)
     elif is_audio:
-        audio_path = file_path
+        return file_path
     else:
         raise ValueError("Unsupported file type. Only MP3, WAV, MP4, or MOV files are supported.")
 
-    # Transcribe the audio
-    if use_api:
-        print("OpenAI API not ready yet...")
-        # transcription = transcribe_audio_api(audio_path)
-    else:
-        transcription = transcribe_audio_local(audio_path)
+def process_media_file(file_path: str, use_api: bool = False, use_vad: bool = False, preset: str = DEFAULT_PRESET, language: Optional[str] = None, cancel_event: Optional[threading.Event] = None) -> tuple[str, str, dict]:
+    """
+    Process a media file to generate subtitles.
+    
+    Args:
+        file_path: Path to the media file (audio or video)
+        use_api: Whether to use the OpenAI API (True) or local model (False)
+        use_vad: Whether to skip silence/non-speech before transcribing (local model only)
+        preset: Speed/accuracy preset for the local model (see TRANSCRIPTION_PRESETS)
+        language: Source-language hint (ex. "en"); skips language detection if provided
+        cancel_event: Event set when the client disconnects; stops processing and removes partial outputs (optional)
+        
+    Returns:
+        Tuple of (vtt_file_path, media_file_path, stats)
+    """
+    
+    process_start = time.perf_counter()
 
-    # Generate VTT subtitles
-    vtt_path = generate_vtt_from_transcription(transcription)
+    audio_path = get_audio_path(file_path, cancel_event)
+    is_video = audio_path != file_path
+
+    try:
+        # Transcribe the audio
+        if use_api:
+            print("OpenAI API not ready yet...")
+            # transcription = transcribe_audio_api(audio_path)
+        else:
+            transcription = transcribe_audio_local(audio_path, preset, normalize_language(language), use_vad, cancel_event)
+
+        # Generate VTT subtitles
+        raise_if_cancelled(cancel_event)
+        vtt_path = generate_vtt_from_transcription(transcription, os.path.splitext(file_path)[0] + ".vtt")   # named after the (unique) upload
+    except ProcessingCancelled:
+        # Remove the audio extracted for this request (the uploaded file is removed by the caller)
+        if is_video and os.path.exists(audio_path):
+            os.remove(audio_path)
+        raise
 
     # print("DEBUG: transcription.py: vtt_path:", vtt_path, "file_path:", file_path)
     
-    # Return the paths to the VTT file and media file
-    return vtt_path, file_path
\ No newline at end of file
+    # Collect processing stats (latency / real-time factor, how much audio the VAD pre-pass skipped)
+    stats = {"total_seconds": round(time.perf_counter() - process_start, 3)}
+    if "timing" in transcription:
+        stats["transcription"] = transcription["timing"]
+    if "vad" in transcription:
+        stats["vad"] = transcription["vad"]
+    
+    # Return the paths to the VTT file and media file, along with the stats
+    return vtt_path, file_path, stats
\ No newline at end of file
@@ -1,9 +1,12 @@
 import os
+import asyncio
+import threading
 from fastapi import HTTPException
 from pathlib import Path
 from typing import Optional, Tuple, List
 from google import genai
 from app.core.config import settings
+from app.services.cancellation import ProcessingCancelled, raise_if_cancelled
 
 LANGUAGE_CODE_TO_NAME = {
     "detect": "(Detect Language)",
@@ -182,7 +185,98 @@ def create_concise_prompt(vtt_string: str, source_language: str, target_language
 
     return prompt
 
-def process_vtt_file(vtt_path: str, source_language: str, target_language: str) -> tuple[str, str]:
+def generate_translation(prompt: str, cancel_event: Optional[threading.Event] = None) -> str:
+    """
+    Send a translation prompt to Gemini, aborting the request if the client disconnects.
+    
+    Args:
+        prompt: Translation prompt (from create_concise_prompt)
+        cancel_event: Event set when the client disconnects (optional)
+        
+    Returns:
+        Text of Gemini's response
+    """
+    raise_if_cancelled(cancel_event)    # e.g. a queued batch starting after the pipeline was stopped
+
+    async def generate() -> str:
+        client = genai.Client(api_key=settings.GEMINI_API_KEY)
+        request = asyncio.ensure_future(client.aio.models.generate_content(
+            model="gemini-2.0-flash", contents=prompt
+        ))
+        while not request.done():
+            await asyncio.wait({request}, timeout=0.25)
+            if not request.done() and cancel_event is not None and cancel_event.is_set():
+                request.cancel()    # closes the in-flight HTTP request
+                raise ProcessingCancelled("Client disconnected")
+        return request.result().text
+
+    return asyncio.run(generate())
+
+def strip_vtt_header(vtt_string: str) -> str:
+    """
+    Remove the WEBVTT header (and any markdown code fences) from a VTT string, leaving only the cues.
+    
+    Args:
+        vtt_string: Content of a VTT file as a string
+
+    Returns:
+        VTT cues as a string
+    """
+    lines = [line for line in vtt_string.strip().splitlines() if not line.strip().startswith("```")]
+    if lines and lines[0].strip().startswith("WEBVTT"):
+        lines = lines[1:]
+
+    return "\n".join(lines).strip() + "\n\n"
+
+def get_vtt_cue_timings(vtt_string: str) -> List[Tuple[str, str]]:
+    """
+    List the cue numbers and timing lines of a VTT string (used to check a translation kept every cue intact).
+    
+    Args:
+        vtt_string: VTT content or cues as a string
+
+    Returns:
+        List of (cue number, timing line) pairs, in order ("" if a cue has no number)
+    """
+    cues = []
+    previous_line = ""
+    for line in vtt_string.splitlines():
+        line = line.strip()
+        if "-->" in line:
+            cue_number = previous_line if previous_line.isdigit() else ""
+            cues.append((cue_number, " ".join(line.split())))    # ignore whitespace differences
+        if line:
+            previous_line = line
+
+    return cues
+
+def translate_vtt_cues(vtt_cues: str, source_language: str, target_language: str, cancel_event: Optional[threading.Event] = None) -> str:
+    """
+    Translate a batch of VTT cues (ex. part of a subtitle file that is still being transcribed).
+    
+    Args:
+        vtt_cues: VTT cues as a string (without the WEBVTT header)
+        source_language: Source language of the subtitles (if "detect" then detect)
+        target_language: Target language for translation
+        cancel_event: Event set when the client disconnects; aborts the Gemini request (optional)
+
+    Returns:
+        Translated VTT cues as a string (without the WEBVTT header)
+    """
+    prompt = create_concise_prompt(f"WEBVTT\n\n{vtt_cues}", source_language, target_language)
+    expected_cues = get_vtt_cue_timings(vtt_cues)
+
+    # Batches are joined as-is, so a dropped, merged or renumbered cue would corrupt the final file
+    for attempt in range(settings.PIPELINE_TRANSLATION_ATTEMPTS):
+        translated_cues = strip_vtt_header(generate_translation(prompt, cancel_event))
+        received_cues = get_vtt_cue_timings(translated_cues)
+        if received_cues == expected_cues:
+            return translated_cues
+        print(f"DEBUG: translation.py: translated batch does not match the original cues ({len(received_cues)} received, {len(expected_cues)} sent), attempt {attempt + 1}")
+
+    raise Exception("Translated subtitles do not match the original cues (numbers or timestamps changed)")
+
+def process_vtt_file(vtt_path: str, source_language: str, target_language: str, cancel_event: Optional[threading.Event] = None) -> tuple[str, str]:
     """
     Translate subtitles from source language (if provided) to target language.
     
@@ -190,6 +284,7 @@ def process_vtt_file(vtt_path: str, source_language: str, target_language: str)
         vtt_path: Path to the VTT file to be translated
         source_language: Source language of the subtitles (if "auto" then detect)
         target_language: Target language for translation
+        cancel_event: Event set when the client disconnects; aborts the Gemini request (optional)
         
     Returns:
         Path to the translated VTT file
@@ -217,13 +312,10 @@ def process_vtt_file(vtt_path: str, source_language: str, target_language: str)
 
     prompt = create_concise_prompt(vtt_string, source_language, target_language)
 
-    client = genai.Client(api_key=settings.GEMINI_API_KEY)
-
-    response = client.models.generate_content(
-        model="gemini-2.0-flash", contents=prompt
-    )
-    print(f"\nResponse from Gemini: {response.text[:100]}...")  # Print first 100 characters for debugging
+    translated_vtt_string = generate_translation(prompt, cancel_event)
+    print(f"\nResponse from Gemini: {translated_vtt_string[:100]}...")  # Print first 100 characters for debugging
 
-    translated_vtt_path = create_vtt_from_translated_string(response.text, vtt_path, target_language)
+    raise_if_cancelled(cancel_event)
+    translated_vtt_path = create_vtt_from_translated_string(translated_vtt_string, vtt_path, target_language)
 
     return translated_vtt_path
\ No newline at end of file
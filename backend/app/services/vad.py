@@ -0,0 +1,155 @@
+import bisect
+import numpy as np
+import webrtcvad
+from typing import List, Tuple
+from whisper.audio import SAMPLE_RATE
+from app.core.config import settings
+
+def detect_speech_regions(audio: np.ndarray, aggressiveness: int = None) -> List[Tuple[float, float]]:
+    """
+    Find the regions of an audio clip that contain speech using WebRTC VAD (runs locally on CPU).
+
+    Args:
+        audio: Mono float32 audio sampled at 16kHz (as returned by whisper.load_audio)
+        aggressiveness: How aggressively non-speech is filtered out (0-3, defaults to settings.VAD_AGGRESSIVENESS)
+
+    Returns:
+        List of (start, end) speech regions in seconds, sorted and non-overlapping
+    """
+    if aggressiveness is None:
+        aggressiveness = settings.VAD_AGGRESSIVENESS
+    vad = webrtcvad.Vad(aggressiveness)
+
+    # WebRTC VAD only accepts 10/20/30ms frames of 16-bit PCM
+    frame_ms = 30
+    frame_length = SAMPLE_RATE * frame_ms // 1000
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+    num_frames = len(pcm) // frame_length
+
+    # Group consecutive speech frames into (start_frame, end_frame) regions
+    regions = []
+    start = None
+    for i in range(num_frames):
+        frame = pcm[i * frame_length:(i + 1) * frame_length].tobytes()
+        if vad.is_speech(frame, SAMPLE_RATE):
+            if start is None:
+                start = i
+        elif start is not None:
+            regions.append([start * frame_ms / 1000, i * frame_ms / 1000])
+            start = None
+    if start is not None:
+        regions.append([start * frame_ms / 1000, num_frames * frame_ms / 1000])
+
+    # Bridge short pauses so sentences are not chopped into pieces
+    min_silence = settings.VAD_MIN_SILENCE_MS / 1000
+    merged = []
+    for region in regions:
+        if merged and region[0] - merged[-1][1] < min_silence:
+            merged[-1][1] = region[1]
+        else:
+            merged.append(region)
+
+    # Drop short bursts (clicks, breaths), then pad what is left so word edges are not clipped
+    min_speech = settings.VAD_MIN_SPEECH_MS / 1000
+    padding = settings.VAD_SPEECH_PAD_MS / 1000
+    duration = len(audio) / SAMPLE_RATE
+    speech_regions = []
+    for start_time, end_time in merged:
+        if end_time - start_time < min_speech:
+            continue
+        start_time = max(0.0, start_time - padding)
+        end_time = min(duration, end_time + padding)
+        if speech_regions and start_time <= speech_regions[-1][1]:
+            speech_regions[-1] = (speech_regions[-1][0], end_time)
+        else:
+            speech_regions.append((start_time, end_time))
+
+    return speech_regions
+
+def collect_speech_audio(audio: np.ndarray, regions: List[Tuple[float, float]]) -> Tuple[np.ndarray, List[Tuple[float, float]]]:
+    """
+    Concatenate the speech regions of an audio clip into a single (shorter) clip.
+
+    Args:
+        audio: Mono float32 audio sampled at 16kHz
+        regions: Speech regions in seconds (from detect_speech_regions)
+
+    Returns:
+        Tuple of (speech_audio, offsets) where offsets holds (speech_start, original_start) for each region
+    """
+    chunks = []
+    offsets = []
+    position = 0.0
+    for start_time, end_time in regions:
+        chunk = audio[int(start_time * SAMPLE_RATE):int(end_time * SAMPLE_RATE)]
+        offsets.append((position, start_time))
+        chunks.append(chunk)
+        position += len(chunk) / SAMPLE_RATE
+
+    speech_audio = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+    return speech_audio, offsets
+
+def remap_timestamp(seconds: float, offsets: List[Tuple[float, float]], is_end: bool = False) -> float:
+    """
+    Map a timestamp on the concatenated speech clip back onto the original timeline.
+
+    Args:
+        seconds: Timestamp in the concatenated speech clip
+        offsets: (speech_start, original_start) pairs from collect_speech_audio
+        is_end: Whether this is an end timestamp (a time exactly on a splice belongs to the earlier region)
+
+    Returns:
+        Timestamp in seconds on the original timeline
+    """
+    if not offsets:
+        return seconds
+    speech_starts = [speech_start for speech_start, _ in offsets]
+    if is_end:
+        index = bisect.bisect_left(speech_starts, seconds) - 1
+    else:
+        index = bisect.bisect_right(speech_starts, seconds) - 1
+    speech_start, original_start = offsets[max(index, 0)]
+    return original_start + (seconds - speech_start)
+
+def remap_transcription(transcription: dict, offsets: List[Tuple[float, float]]) -> dict:
+    """
+    Shift the segment (and word) timestamps of a Whisper transcription back onto the original timeline.
+
+    Args:
+        transcription: Whisper transcription of the concatenated speech clip
+        offsets: (speech_start, original_start) pairs from collect_speech_audio
+
+    Returns:
+        The same transcription dictionary with remapped timestamps
+    """
+    for segment in transcription.get('segments', []):
+        segment['start'] = remap_timestamp(segment['start'], offsets)
+        segment['end'] = remap_timestamp(segment['end'], offsets, is_end=True)
+        for word in segment.get('words', []):
+            word['start'] = remap_timestamp(word['start'], offsets)
+            word['end'] = remap_timestamp(word['end'], offsets, is_end=True)
+
+    return transcription
+
+def get_vad_stats(audio: np.ndarray, regions: List[Tuple[float, float]]) -> dict:
+    """
+    Summarize how much of an audio clip was skipped by the VAD pre-pass.
+
+    Args:
+        audio: Mono float32 audio sampled at 16kHz
+        regions: Speech regions in seconds (from detect_speech_regions)
+
+    Returns:
+        Dictionary with total, speech and skipped durations (seconds) and the skipped ratio
+    """
+    audio_seconds = len(audio) / SAMPLE_RATE
+    speech_seconds = sum(end_time - start_time for start_time, end_time in regions)
+    skipped_seconds = max(0.0, audio_seconds - speech_seconds)
+
+    return {
+        "audio_seconds": round(audio_seconds, 3),
+        "speech_seconds": round(speech_seconds, 3),
+        "skipped_seconds": round(skipped_seconds, 3),
+        "skipped_ratio": round(skipped_seconds / audio_seconds, 4) if audio_seconds else 0.0,
+        "speech_regions": len(regions),
+    }